@@ -0,0 +1,73 @@
+// Helpers compartidos de los gráficos (/finanzas, /io).
+// Se cachea un año: BASE_HTML lo pide con ?v=<hash del contenido>.
+
+// Regex de miles compilada una sola vez (no en cada tooltip/tick)
+const THOUSANDS = /\B(?=(\d{3})+(?!\d))/g;
+
+function fmtMoney(v){
+  const n = Math.round(Number(v||0));
+  const s = n.toString().replace(THOUSANDS, ".");
+  return "$ " + s;
+}
+
+// Datos ya en formato interno de Chart.js ({x: índice, y}): permite parsing:false
+function toPoints(values) {
+  return (values || []).map((v, i) => ({x: i, y: v}));
+}
+
+// Sombra bajo cada dataset (cada página elige intensidad)
+function makeShadowPlugin(color, blur, offsetY) {
+  return {
+    id: 'shadowPlugin',
+    beforeDatasetDraw(chart) {
+      const ctx = chart.ctx;
+      ctx.save();
+      ctx.shadowColor = color;
+      ctx.shadowBlur = blur;
+      ctx.shadowOffsetX = 0;
+      ctx.shadowOffsetY = offsetY;
+    },
+    afterDatasetDraw(chart) {
+      chart.ctx.restore();
+    }
+  };
+}
+
+const pieValuePlugin = {
+  id: 'pieValuePlugin',
+  afterDatasetsDraw(chart) {
+    if (chart.config.type !== 'pie') return;
+    const ctx = chart.ctx;
+    const dataset = chart.data.datasets[0];
+    const meta = chart.getDatasetMeta(0);
+    const data = dataset.data || [];
+
+    ctx.save();
+    ctx.font = '800 12px Arial';
+    ctx.fillStyle = '#111827';
+    ctx.textAlign = 'center';
+    ctx.textBaseline = 'middle';
+
+    meta.data.forEach((arc, i) => {
+      const v = Number(data[i] || 0);
+      if (!v) return;
+
+      const label = fmtMoney(v);
+
+      const angle = (arc.startAngle + arc.endAngle) / 2;
+      const r = arc.outerRadius * 0.70;
+      const x = arc.x + Math.cos(angle) * r;
+      const y = arc.y + Math.sin(angle) * r;
+      ctx.fillText(label, x, y);
+    });
+
+    ctx.restore();
+  }
+};
+
+function makeBarGradient(ctx, baseColor) {
+  const g = ctx.createLinearGradient(0, 0, 0, 280);
+  g.addColorStop(0, baseColor.replace('0.28', '0.45').replace('0.22','0.40'));
+  g.addColorStop(1, baseColor.replace('0.28', '0.15').replace('0.22','0.12'));
+  return g;
+}